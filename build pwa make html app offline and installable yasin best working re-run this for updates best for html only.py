@@ -2,8 +2,17 @@ import os
 import json
 import re
 import hashlib
+import html
+import io
+import mmap
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PIL import Image
-from bs4 import BeautifulSoup
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
 
 SOURCE_LOGO_PATH = r"C:\Users\Yasin\Downloads\Yasin Soft\logo.png"
 PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,13 +22,82 @@ APP_DESCRIPTION = "A description of the web application."
 BACKGROUND_COLOR = "#ffffff"
 THEME_COLOR = "#007bff"
 VERSION = "1.0.9"
+HASH_CACHE_FILE = ".pwa-cache.json"
+MAX_PRECACHE_BYTES = 10 * 1024 * 1024  # larger files are left out of the precache list
+HASH_CHUNK_SIZE = 1 << 20  # 1 MiB read size when streaming files through the hasher
+# Written by this script after discovery; their revisions come from the generation step instead.
+GENERATED_FILES = {"manifest.json", "sw.js", HASH_CACHE_FILE}
+TEMP_SUFFIX = ".pwa.tmp"
+
+MANIFEST_LINK_STR = '<link rel="manifest" href="manifest.json">'
+FAVICON_LINK_STR = '<link rel="icon" type="image/x-icon" href="favicon.ico">'
+SW_SCRIPT_STR = """<script type="module">
+  import { Workbox } from 'https://storage.googleapis.com/workbox-cdn/releases/7.0.0/workbox-window.prod.mjs';
+
+  const swUrl = './sw.js';
+  const wb = new Workbox(swUrl);
+
+  wb.addEventListener('waiting', () => {
+    console.log('A new service worker is waiting to activate.');
+    wb.messageSW({ type: 'SKIP_WAITING' });
+  });
+
+  wb.addEventListener('controlling', () => {
+    console.log('The new service worker is now in control. Reloading page for updates...');
+    window.location.reload();
+  });
+
+  wb.register();
+</script>"""
+SCRIPT_BLOCK_RE = re.compile(r"[ \t]*<script\b[^>]*>(.*?)</script\s*>[ \t]*\n?", re.IGNORECASE | re.DOTALL)
+HEAD_END_RE = re.compile(r"</head\s*>", re.IGNORECASE)
+# Fallback anchors when </head> was omitted, tried in order; never insert ahead of the doctype.
+HEAD_FALLBACK_RES = [
+    re.compile(r"<head\b[^>]*>", re.IGNORECASE),
+    re.compile(r"<html\b[^>]*>", re.IGNORECASE),
+    re.compile(r"<!doctype\b[^>]*>", re.IGNORECASE),
+]
+BODY_END_RE = re.compile(r"</body\s*>", re.IGNORECASE)
+HTML_END_RE = re.compile(r"</html\s*>", re.IGNORECASE)
+# One pass reports which PWA pieces a page already has, via the name of the matching group.
+# manifest/icon only count inside a <link> tag, so text or scripts mentioning rel="icon" are ignored.
+CHECKS_RE = re.compile(
+    r"""(?P<manifest><link\b[^>]*\srel\s*=\s*["']?manifest["'\s>/])"""
+    r"""|(?P<icon><link\b[^>]*\srel\s*=\s*["']?(?:shortcut\s+)?icon["'\s>/])"""
+    r"""|(?P<sw>workbox-window|navigator\.serviceWorker)""",
+    re.IGNORECASE,
+)
+TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title\s*>", re.IGNORECASE | re.DOTALL)
+TITLE_SCAN_BYTES = 16 * 1024  # <title> lives in <head>, so only the start of the page is read
+
+def _new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+def get_bytes_hash(data):
+    if blake3 is not None:
+        return blake3(data).hexdigest(16)
+    hasher = _new_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
 
 def get_file_hash(path):
-    hasher = hashlib.md5()
     try:
-        with open(path, 'rb') as f:
-            buf = f.read()
-            hasher.update(buf)
+        if blake3 is not None:
+            hasher = blake3(max_threads=blake3.AUTO)
+            hasher.update_mmap(path)
+            return hasher.hexdigest(16)
+        with open(path, 'rb', buffering=0) as f:
+            if os.fstat(f.fileno()).st_size > HASH_CHUNK_SIZE:
+                # Let the kernel page large files straight into the hasher instead of copying chunks.
+                hasher = _new_hasher()
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    hasher.update(mm)
+                return hasher.hexdigest()
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, _new_hasher).hexdigest()
+            hasher = _new_hasher()
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                hasher.update(chunk)
         return hasher.hexdigest()
     except Exception as e:
         print(f"   ❌ Could not hash file {os.path.basename(path)}: {e}")
@@ -32,14 +110,34 @@ def generate_favicon(source_path, output_dir):
         with Image.open(source_path) as logo:
             logo = logo.convert("RGBA")
             logo.thumbnail((64, 64))  # Standard favicon size
-            logo.save(favicon_path, format="ICO", sizes=[(16, 16), (32, 32), (48, 48), (64, 64)])
+            buf = io.BytesIO()
+            logo.save(buf, format="ICO", sizes=[(16, 16), (32, 32), (48, 48), (64, 64)])
+        data = buf.getvalue()
+        with open(favicon_path, 'wb') as f:
+            f.write(data)
         print(f"✅ Created: favicon.ico")
-        file_hash = get_file_hash(favicon_path)
+        file_hash = get_bytes_hash(data)
         return {"url": "favicon.ico", "revision": file_hash} if file_hash else None
     except Exception as e:
         print(f"❌ Error generating favicon.ico: {e}")
         return None
 
+def _save_icon(job, output_dir):
+    size, icon_size, icon_bytes = job
+    icon = Image.frombytes("RGBA", icon_size, icon_bytes)
+    filename = f"icon-{size}.png"
+    output_path = os.path.join(output_dir, filename)
+    canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    left = (size - icon.width) // 2
+    top = (size - icon.height) // 2
+    canvas.paste(icon, (left, top))
+    buf = io.BytesIO()
+    canvas.save(buf, "PNG")
+    data = buf.getvalue()
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return get_bytes_hash(data)
+
 def generate_pwa_icons(source_path, output_dir):
     print("--- 1. Generating PWA Icons ---")
     if not os.path.exists(source_path):
@@ -51,46 +149,114 @@ def generate_pwa_icons(source_path, output_dir):
     try:
         with Image.open(source_path) as logo:
             logo = logo.convert("RGBA")
-            for size in icon_sizes:
-                filename = f"icon-{size}.png"
-                output_path = os.path.join(output_dir, filename)
-                canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                logo_copy = logo.copy()
-                logo_copy.thumbnail((size, size))
-                left = (size - logo_copy.width) // 2
-                top = (size - logo_copy.height) // 2
-                canvas.paste(logo_copy, (left, top))
-                canvas.save(output_path, "PNG")
-                print(f"✅ Created: {filename}")
-                file_hash = get_file_hash(output_path)
-                if file_hash:
-                    generated_icons.append({"url": filename, "revision": file_hash})
-                icon_metadata.append({"src": filename, "sizes": f"{size}x{size}", "type": "image/png"})
+            logo.thumbnail((max(icon_sizes), max(icon_sizes)), Image.LANCZOS)
+            # Downscale each size from the previous (larger) one instead of the full-size source.
+            current = logo
+            jobs = []
+            for size in sorted(icon_sizes, reverse=True):
+                if max(current.size) > size:
+                    scale = size / max(current.size)
+                    target = (max(1, round(current.width * scale)), max(1, round(current.height * scale)))
+                    current = current.resize(target, Image.LANCZOS)
+                jobs.append((size, current.size, current.tobytes()))
+        # Canvas paste + PNG encode for each size runs in its own process; pixels are sent as raw bytes.
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+            hashes = executor.map(partial(_save_icon, output_dir=output_dir), jobs)
+            icon_hashes = dict(zip((job[0] for job in jobs), hashes))
+        for size in icon_sizes:
+            filename = f"icon-{size}.png"
+            print(f"✅ Created: {filename}")
+            file_hash = icon_hashes[size]
+            if file_hash:
+                generated_icons.append({"url": filename, "revision": file_hash})
+            icon_metadata.append({"src": filename, "sizes": f"{size}x{size}", "type": "image/png"})
         return generated_icons, icon_metadata
     except Exception as e:
         print(f"❌ Error generating icons: {e}")
         return [], []
 
+def _scan(path):
+    # Like os.walk, unreadable directories are skipped instead of aborting the build.
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return
+    with it:
+        while True:
+            try:
+                entry = next(it)
+            except StopIteration:
+                break
+            except OSError:
+                return
+            # Symlinks report False for both checks, so they are skipped; hidden dirs are never entered.
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    yield from _scan(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+def load_hash_cache(project_dir):
+    cache_path = os.path.join(project_dir, HASH_CACHE_FILE)
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except Exception as e:
+        print(f"⚠️ Could not read hash cache, re-hashing all files: {e}")
+        return {}
+
+def save_hash_cache(project_dir, cache):
+    try:
+        with open(os.path.join(project_dir, HASH_CACHE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+    except Exception as e:
+        print(f"⚠️ Could not write hash cache: {e}")
+
 def discover_assets(project_dir, generated_icons):
     print(f"\n--- 2. Discovering App Files and Generating Hashes ---")
     precache_list = generated_icons[:]
     existing_urls = {entry['url'] for entry in precache_list}
     html_files = []
+    to_hash = []
+    hash_cache = load_hash_cache(project_dir)
+    new_cache = {}
     
-    for root, _, files in os.walk(project_dir):
-        if any(part.startswith('.') for part in root.split(os.sep)):
+    for entry in _scan(project_dir):
+        file_path = entry.path
+        relative_path = os.path.relpath(file_path, project_dir).replace("\\", "/")
+        if relative_path in existing_urls or relative_path in GENERATED_FILES or entry.name.endswith(TEMP_SUFFIX):
             continue
-        for file in files:
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, project_dir).replace("\\", "/")
-            if relative_path in existing_urls:
-                continue
-            if file.endswith(".html"):
-                html_files.append(file_path)
-            file_hash = get_file_hash(file_path)
-            if file_hash:
-                precache_list.append({"url": relative_path, "revision": file_hash})
-                existing_urls.add(relative_path)
+        try:
+            st = entry.stat()
+        except OSError as e:
+            print(f"   ⚠️ Skipping {relative_path}, could not stat it: {e}")
+            continue
+        if entry.name.lower().endswith(".html"):
+            html_files.append(file_path)
+        if st.st_size > MAX_PRECACHE_BYTES:
+            print(f"   ⚠️ Skipping large file {relative_path} ({st.st_size / (1024 * 1024):.1f} MB), not precached.")
+            continue
+        cached = hash_cache.get(relative_path)
+        if isinstance(cached, dict) and cached.get("mtime_ns") == st.st_mtime_ns and cached.get("size") == st.st_size:
+            file_hash = cached.get("hash")
+        else:
+            file_hash = None
+        to_hash.append((relative_path, file_path, st, file_hash))
+        existing_urls.add(relative_path)
+
+    stale_paths = [file_path for _, file_path, _, file_hash in to_hash if not file_hash]
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        fresh_hashes = dict(zip(stale_paths, executor.map(get_file_hash, stale_paths)))
+    for relative_path, file_path, st, file_hash in to_hash:
+        file_hash = file_hash or fresh_hashes.get(file_path)
+        if file_hash:
+            precache_list.append({"url": relative_path, "revision": file_hash})
+            new_cache[relative_path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "hash": file_hash}
+    save_hash_cache(project_dir, new_cache)
+    print(f"   - Re-hashed {len(stale_paths)} files, reused {len(to_hash) - len(stale_paths)} cached hashes.")
     if not html_files:
         print("❌ Error: No HTML files found.")
         return [], []
@@ -103,15 +269,16 @@ def create_manifest(output_dir, icon_metadata, html_files):
     potential_mains = [f for f in html_files if "index.html" in f.lower()] or html_files
     if not potential_mains:
         print("❌ Error: No suitable start file (like index.html) found.")
-        return
+        return None
     start_file_path = potential_mains[0]
     start_url = os.path.relpath(start_file_path, output_dir).replace("\\", "/")
     try:
-        with open(start_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            soup = BeautifulSoup(f.read(), 'html.parser')
-            if soup.title and soup.title.string:
-                app_title_from_html = soup.title.string.strip()
-                print(f"✅ Detected App Title: '{app_title_from_html}'")
+        with open(start_file_path, 'rb') as f:
+            head = f.read(TITLE_SCAN_BYTES).decode('utf-8', 'ignore')
+        match = TITLE_RE.search(head)
+        if match and match.group(1).strip():
+            app_title_from_html = html.unescape(match.group(1)).strip()
+            print(f"✅ Detected App Title: '{app_title_from_html}'")
     except Exception as e:
         print(f"⚠️ Could not read title from HTML: {e}")
     manifest = {
@@ -125,12 +292,16 @@ def create_manifest(output_dir, icon_metadata, html_files):
         "orientation": "portrait-primary",
         "icons": icon_metadata
     }
-    with open(os.path.join(output_dir, "manifest.json"), 'w', encoding='utf-8') as f:
-        json.dump(manifest, f, indent=2)
+    data = json.dumps(manifest, indent=2).encode('utf-8')
+    with open(os.path.join(output_dir, "manifest.json"), 'wb') as f:
+        f.write(data)
     print(f"✅ Created: manifest.json")
+    return {"url": "manifest.json", "revision": get_bytes_hash(data)}
 
 def create_service_worker(output_dir, precache_list):
     print("\n--- 4. Creating sw.js (Service Worker) ---")
+    # Scan order is filesystem-dependent; sorting keeps sw.js byte-identical when nothing changed.
+    precache_list = sorted(precache_list, key=lambda entry: entry['url'])
     sw_template = f"""
 // Auto-generated by PWA builder script.
 importScripts('https://storage.googleapis.com/workbox-cdn/releases/7.0.0/workbox-sw.js');
@@ -145,7 +316,7 @@ if (workbox) {{
       }}
     }});
 
-    workbox.precaching.precacheAndRoute({json.dumps(precache_list, indent=4)});
+    workbox.precaching.precacheAndRoute({json.dumps(precache_list, separators=(',', ':'))});
 
     workbox.routing.registerRoute(
         ({{request}}) => request.destination === 'style' || request.destination === 'script',
@@ -175,51 +346,78 @@ if (workbox) {{
         f.write(sw_template.strip())
     print("✅ Created: sw.js")
 
-def update_html_files(html_files):
-    print("\n--- 5. Updating HTML Files ---")
-    manifest_link_str = '<link rel="manifest" href="manifest.json">'
-    favicon_link_str = '<link rel="icon" type="image/x-icon" href="favicon.ico">'
-    sw_script_str = f"""<script type="module">
-  import {{ Workbox }} from 'https://storage.googleapis.com/workbox-cdn/releases/7.0.0/workbox-window.prod.mjs';
+def insert_before(content, closing_tag_re, snippet, last=False):
+    if last:
+        match = None
+        for match in closing_tag_re.finditer(content):
+            pass
+    else:
+        match = closing_tag_re.search(content)
+    if not match:
+        return None
+    return content[:match.start()] + snippet + "\n" + content[match.start():]
 
-  const swUrl = './sw.js';
-  const wb = new Workbox(swUrl);
+def insert_after(content, opening_tag_re, snippet):
+    match = opening_tag_re.search(content)
+    if not match:
+        return None
+    return content[:match.end()] + "\n" + snippet + content[match.end():]
 
-  wb.addEventListener('waiting', () => {{
-    console.log('A new service worker is waiting to activate.');
-    wb.messageSW({{ type: 'SKIP_WAITING' }});
-  }});
+def ensure_in_head(content, snippet, head_end_re=HEAD_END_RE):
+    updated = insert_before(content, head_end_re, snippet)
+    if updated is not None:
+        return updated
+    for opening_tag_re in HEAD_FALLBACK_RES:
+        updated = insert_after(content, opening_tag_re, snippet)
+        if updated is not None:
+            return updated
+    return snippet + "\n" + content
 
-  wb.addEventListener('controlling', () => {{
-    console.log('The new service worker is now in control. Reloading page for updates...');
-    window.location.reload();
-  }});
+def ensure_before_body_end(content, snippet, body_end_re=BODY_END_RE):
+    # Last </body>, so a "</body>" inside an inline script string is not picked up.
+    # </body> is optional, so fall back to the last </html>. The snippet always carries its own
+    # trailing newline, which is exactly what SCRIPT_BLOCK_RE strips again on the next run.
+    for closing_tag_re in (body_end_re, HTML_END_RE):
+        updated = insert_before(content, closing_tag_re, snippet, last=True)
+        if updated is not None:
+            return updated
+    return content + snippet + "\n"
 
-  wb.register();
-</script>"""
-    for html_path in html_files:
+def _strip_sw_script(match):
+    body = match.group(1)
+    return "" if "workbox-window" in body or "navigator.serviceWorker" in body else match.group(0)
+
+def update_html_file(html_path):
+    try:
+        with open(html_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+        found = {match.lastgroup for match in CHECKS_RE.finditer(content)}
+        updated = SCRIPT_BLOCK_RE.sub(_strip_sw_script, content) if "sw" in found else content
+        updated = ensure_before_body_end(updated, SW_SCRIPT_STR)
+        # One head insertion, so the link order is the same whichever anchor ensure_in_head finds.
+        head_links = [link for key, link in (("manifest", MANIFEST_LINK_STR), ("icon", FAVICON_LINK_STR)) if key not in found]
+        if head_links:
+            updated = ensure_in_head(updated, "\n".join(head_links))
+
+        if updated == content:
+            print(f"   - {os.path.basename(html_path)} already up to date")
+            return
+        tmp_path = html_path + TEMP_SUFFIX
         try:
-            with open(html_path, 'r+', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                soup = BeautifulSoup(content, 'html.parser')
-
-                for s in soup.find_all("script"):
-                    if "workbox-window" in s.text or "navigator.serviceWorker" in s.text:
-                        s.decompose()
-
-                soup.body.append(BeautifulSoup(sw_script_str, 'html.parser'))
-
-                if not soup.head.find('link', {'rel': 'manifest'}):
-                    soup.head.append(BeautifulSoup(manifest_link_str, 'html.parser'))
-                if not soup.head.find('link', {'rel': 'icon'}):
-                    soup.head.append(BeautifulSoup(favicon_link_str, 'html.parser'))
-
-                f.seek(0)
-                f.write(str(soup))
-                f.truncate()
-                print(f"   - Injected scripts & links into {os.path.basename(html_path)}")
-        except Exception as e:
-            print(f"   ❌ Could not update {os.path.basename(html_path)}: {e}")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(updated)
+            os.replace(tmp_path, html_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"   - Injected scripts & links into {os.path.basename(html_path)}")
+    except Exception as e:
+        print(f"   ❌ Could not update {os.path.basename(html_path)}: {e}")
+
+def update_html_files(html_files):
+    print("\n--- 5. Updating HTML Files ---")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(update_html_file, html_files))
     print("✅ HTML files updated.")
 
 if __name__ == "__main__":
@@ -236,7 +434,9 @@ if __name__ == "__main__":
     precache_list, html_files = discover_assets(PROJECT_DIR, generated_icons + ([favicon_entry] if favicon_entry else []))
     
     if html_files:
-        create_manifest(PROJECT_DIR, icon_metadata, html_files)
+        manifest_entry = create_manifest(PROJECT_DIR, icon_metadata, html_files)
+        if manifest_entry:
+            precache_list.append(manifest_entry)
         create_service_worker(PROJECT_DIR, precache_list)
         update_html_files(html_files)
         print(f"\n🎉 PWA setup is complete!")